@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the redaction path of filtered_logger
+Usage: ./bench_redaction.py [--lines N] [--fields 1,3,5] ...
+Every combination of PII field count, message length and separator is
+run on a synthetic user_data.csv shaped corpus, and the results are
+printed as JSON (one object per case) so that runs can be compared.
+The redaction of every kind of record is checked first: the benchmark
+exits with an error if a PII value shows in a formatted line.
+"""
+import argparse
+import io
+import json
+import logging
+import random
+import string
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+import filtered_logger
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+
+# the non PII columns of user_data.csv, used as filler fields
+OTHER_FIELDS = ('ip', 'last_login', 'user_agent')
+
+
+def generate_lines(count: int, pii_count: int = len(PII_FIELDS),
+                   length: int = 150, separator: str = ";",
+                   seed: int = 0) -> List[str]:
+    """
+    Generate synthetic user_data log messages
+    Args:
+        count: the number of lines
+        pii_count: how many of the PII_FIELDS each line holds
+        length: the approximate length of a line, padded by user_agent
+        separator: the character ending each field value
+        seed: the random seed, the same seed gives the same corpus
+    Returns:
+        the list of messages
+    """
+    rand = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    names = PII_FIELDS[:pii_count] + OTHER_FIELDS
+    lines = []
+    for _ in range(count):
+        values = ["".join(rand.choice(alphabet)
+                          for _ in range(rand.randint(6, 14)))
+                  for _ in names]
+        line = " ".join("{}={}{}".format(name, value, separator)
+                        for name, value in zip(names, values))
+        # the user_agent, last, is padded up to the requested length
+        if len(line) < length:
+            line = line[:-1] + "x" * (length - len(line)) + separator
+        lines.append(line)
+    return lines
+
+
+def _records(lines: List[str]) -> List[logging.LogRecord]:
+    """Wrap messages in log records"""
+    return [logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                              line, None, None) for line in lines]
+
+
+def _run_filter_datum(lines: List[str], separator: str) -> list:
+    """Redact each message with filter_datum"""
+    return [filter_datum(PII_FIELDS, "***", line, separator)
+            for line in lines]
+
+
+def _run_formatter(records: List[logging.LogRecord]) -> list:
+    """Format each record with a RedactingFormatter"""
+    formatter = RedactingFormatter(PII_FIELDS)
+    return [formatter.format(record) for record in records]
+
+
+def _run_logger(lines: List[str]) -> None:
+    """Log each message and wait for the listener to write them all"""
+    logger = filtered_logger.get_logger()
+    for line in lines:
+        logger.info(line)
+    filtered_logger._listener.queue.join()
+
+
+def check_redaction() -> List[str]:
+    """
+    Format plain, dict and `extra` records holding a PII value, in
+    their message, a traceback or a stack, and return the lines where
+    it shows, an empty list if none does
+    """
+    secret = "bob@example.com"
+    pairs = "name=bob; email={}; ip=1.2.3.4;".format(secret)
+    cases = [
+        (pairs, None, {}),
+        (pairs, None, {"request_id": 42}),
+        ("%s", (pairs,), {"request_id": 42}),
+        ("", ({"email": secret, "ip": "1.2.3.4"},), {}),
+        ("", ({"note": pairs},), {}),
+        ("user %(email)s from %(ip)s", ({"email": secret, "ip": pairs},),
+         {}),
+        ("login", None, {"note": pairs}),
+    ]
+    try:
+        raise ValueError(pairs)
+    except ValueError:
+        exc_info = sys.exc_info()
+    formatter = RedactingFormatter(PII_FIELDS)
+    leaks = []
+    # every case again, with the PII in a traceback and in a stack
+    for msg, args, extra in cases:
+        for exc, stack in ((None, None), (exc_info, None), (None, pairs)):
+            record = logging.LogRecord("user_data", logging.INFO,
+                                       __file__, 0, msg, args, exc)
+            record.stack_info = stack
+            record.__dict__.update(extra)
+            line = formatter.format(record)
+            if secret in line:
+                leaks.append(line)
+    return leaks
+
+
+def _measure(func, count: int, repeat: int) -> Dict[str, float]:
+    """Time func over count lines, best of repeat, and trace one run"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        func()
+        elapsed = time.perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # allocations are measured on a separate, slower, traced run
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "lines_per_sec": round(count * 1e9 / best, 1),
+        "ns_per_line": round(best / count, 1),
+        "alloc_bytes_per_line": round(peak / count, 1),
+    }
+
+
+def main():
+    """Run every benchmark case and print the results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lines", type=int, default=10000)
+    parser.add_argument("--fields", default="1,3,5",
+                        help="PII field counts, comma separated")
+    parser.add_argument("--lengths", default="80,300,1000",
+                        help="message lengths, comma separated")
+    parser.add_argument("--separators", default=";,|")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the JSON to this file")
+    args = parser.parse_args()
+
+    leaks = check_redaction()
+    if leaks:
+        sys.exit("PII left in formatted lines:\n" + "\n".join(leaks))
+
+    # the end to end logger writes to memory, not to the terminal
+    filtered_logger.get_logger()
+    filtered_logger._listener.handlers[0].setStream(io.StringIO())
+
+    results = []
+    for pii_count in map(int, args.fields.split(",")):
+        for length in map(int, args.lengths.split(",")):
+            for separator in args.separators.split(","):
+                lines = generate_lines(args.lines, pii_count, length,
+                                       separator)
+                records = _records(lines)
+                cases = {"filter_datum":
+                         lambda: _run_filter_datum(lines, separator)}
+                # the formatter only redacts on its own SEPARATOR
+                if separator == RedactingFormatter.SEPARATOR:
+                    cases["RedactingFormatter.format"] = \
+                        lambda: _run_formatter(records)
+                    cases["get_logger"] = lambda: _run_logger(lines)
+                for name, func in cases.items():
+                    result = {"bench": name, "lines": args.lines,
+                              "pii_fields": pii_count, "length": length,
+                              "separator": separator}
+                    result.update(_measure(func, args.lines, args.repeat))
+                    results.append(result)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
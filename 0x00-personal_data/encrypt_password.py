@@ -1,9 +1,79 @@
 #!/usr/bin/env python3
 """ Implement Password Encryption using Bcrypt """
 
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Tuple, Union
+
 import bcrypt
 
 
+# ================Cost calibration=====================
+# The cost (log2 of the rounds) of bcrypt.gensalt sets how long a hash
+# takes. With BCRYPT_TARGET_MS set, the cost is calibrated when this
+# module is imported, at startup rather than on a login request, to the
+# highest one hashing within that target on this machine; otherwise the
+# bcrypt default is used, until calibrate_cost is called.
+# =====================================================
+
+# bcrypt accepts costs from 4 to 31, gensalt defaults to 12
+MIN_COST = 4
+MAX_COST = 31
+DEFAULT_COST = 12
+
+_cost = None
+# held while calibrating: a concurrent calibration waits for this one
+_cost_lock = threading.Lock()
+
+
+def _hash_time(cost: int) -> float:
+    """Time one hash at the given cost, in milliseconds"""
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration", bcrypt.gensalt(cost))
+    return (time.perf_counter() - start) * 1000
+
+
+def calibrate_cost(target_ms: float) -> int:
+    """
+    Pick the bcrypt cost for hash_password on this machine
+    Args:
+        target_ms: the hashing time not to exceed, in milliseconds
+    Returns:
+        the highest cost hashing within target_ms (never below
+        MIN_COST), which hash_password uses from now on
+    """
+    global _cost
+    with _cost_lock:
+        cost = MIN_COST
+        # every extra round doubles the time: this stops after ~2 targets
+        while cost < MAX_COST and _hash_time(cost + 1) <= target_ms:
+            cost += 1
+        _cost = cost
+    return cost
+
+
+def get_cost() -> int:
+    """Return the cost used by hash_password, never calibrating"""
+    return DEFAULT_COST if _cost is None else _cost
+
+
+if os.getenv('BCRYPT_TARGET_MS'):
+    calibrate_cost(float(os.getenv('BCRYPT_TARGET_MS')))
+
+
+def hash_cost(hashed_password: bytes) -> int:
+    """Return the cost a hash was made with ($2b$<cost>$...)"""
+    return int(hashed_password.split(b"$")[2])
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """Tell if a hash was made with another cost than the current one"""
+    return hash_cost(hashed_password) != get_cost()
+
+
 # ==================Task4==============================
 # User passwords should NEVER be stored in plain text in a database.
 # Implement a hash_password function that expects one string argument
@@ -13,7 +83,8 @@ import bcrypt
 
 def hash_password(password: str) -> bytes:
     """ Hash a password using Bcrypt """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(get_cost()))
 
 
 # =================Task5==============================
@@ -28,3 +99,72 @@ def hash_password(password: str) -> bytes:
 def is_valid(hashed_password: bytes, password: str) -> bool:
     """ Validate hashed password """
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+
+def check_password(hashed_password: bytes,
+                   password: str) -> Tuple[bool, bool]:
+    """
+    Validate a password and tell if its hash should be renewed
+    Returns:
+        (valid, rehash): rehash is True when the password is valid
+        and its hash uses another cost than the current one, so the
+        caller can store hash_password(password) in its place
+    """
+    valid = is_valid(hashed_password, password)
+    return valid, valid and needs_rehash(hashed_password)
+
+
+# ================Batch APIs==========================
+# bcrypt releases the GIL while hashing, so a thread pool spreads the
+# work of many passwords across all the cores.
+# =====================================================
+
+def _map_ordered(func: Callable, items: Iterable,
+                 max_workers: int = None) -> Iterator:
+    """
+    Apply func to items on a thread pool, yielding in input order
+    At most twice max_workers items are in flight, so a large or
+    endless input is never loaded whole.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = [pool.submit(func, *item)
+                   for item in islice(items, 2 * max_workers)]
+        while pending:
+            result = pending.pop(0).result()
+            for item in islice(items, 1):
+                pending.append(pool.submit(func, *item))
+            yield result
+
+
+def hash_password_many(passwords: Iterable[str], max_workers: int = None,
+                       stream: bool = False
+                       ) -> Union[List[bytes], Iterator[bytes]]:
+    """
+    Hash many passwords using Bcrypt on a bounded thread pool
+    Args:
+        passwords: the passwords to hash
+        max_workers: the number of threads, os.cpu_count() by default
+        stream: return an iterator instead of a list
+    Returns:
+        the hashed passwords, in the order of the input
+    """
+    hashed = _map_ordered(hash_password, ((p,) for p in passwords),
+                          max_workers)
+    return hashed if stream else list(hashed)
+
+
+def is_valid_many(pairs: Iterable[tuple], max_workers: int = None,
+                  stream: bool = False) -> Union[List[bool], Iterator[bool]]:
+    """
+    Validate many passwords on a bounded thread pool
+    Args:
+        pairs: (hashed_password, password) tuples
+        max_workers: the number of threads, os.cpu_count() by default
+        stream: return an iterator instead of a list
+    Returns:
+        one boolean per pair, in the order of the input
+    """
+    valid = _map_ordered(is_valid, pairs, max_workers)
+    return valid if stream else list(valid)
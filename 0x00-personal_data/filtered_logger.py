@@ -1,10 +1,34 @@
 #!/usr/bin/env python3
 """Personal Data Template"""
 import re
-from typing import List
+import copy
+import csv
+import json
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping
+from functools import lru_cache
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional,
+                    TextIO, Tuple)
+import atexit
 import logging
+import logging.handlers
 import os
-import mysql.connector
+import queue
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+try:
+    import mysql.connector
+    import mysql.connector.pooling
+except ImportError:
+    # only the SQLite stand-in of get_db is usable
+    mysql = None
 
 # ==========================Task2====================================
 # Implement a get_logger function that takes no arguments and
@@ -54,14 +78,176 @@ import mysql.connector
 # Create a tuple PII_FIELDS constant at the root of the module containing
 PII_FIELDS = ('name', 'email', 'phone', 'ssn', 'password')
 
+# columns of the users table, in the order they are selected by main
+DB_FIELDS = ('name', 'email', 'phone', 'ssn', 'password', 'ip',
+             'last_login', 'user_agent')
+# the fmt used to turn a users row into a log message
+ROW_FORMAT = "name={}; email={}; phone={}; ssn={}; password={};" + \
+             "ip={}; last_login={}; user_agent={}"
+# the same line as a %-template on a row dict, for the structured path
+ROW_TEMPLATE = ROW_FORMAT.format(*("%({})s".format(f) for f in DB_FIELDS))
+# attributes of every LogRecord: anything else was passed in `extra`
+RECORD_ATTRS = frozenset(vars(logging.LogRecord(
+    "", logging.INFO, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def redaction_pattern(fields: Tuple[str, ...], separator: str) -> str:
+    """
+    Return the regex matching the value of any of the fields
+    The field name is captured in group 1.
+    """
+    # one alternation for all the fields: the message is scanned once
+    return "({})=.*?{}".format("|".join(re.escape(f) for f in fields),
+                               re.escape(separator))
+
+
+@lru_cache(maxsize=64)
+def _compiled(fields: Tuple[str, ...], separator: str) -> "re.Pattern":
+    """Return the compiled redaction_pattern of the fields"""
+    return re.compile(redaction_pattern(fields, separator))
+
+
+@lru_cache(maxsize=64)
+def _redactor(fields: Tuple[str, ...], redaction: str,
+              separator: str) -> Callable[[str], str]:
+    """
+    Build a single-pass redaction callable for a set of fields
+    Args:
+        fields: names of the fields to obfuscate
+        redaction: the string that replaces every field value
+        separator: the character ending each field value
+    Returns:
+        a callable taking a message and returning it redacted
+    """
+    if not fields:
+        return str
+    pattern = _compiled(fields, separator)
+    # escape backslashes so the template is taken literally by re.sub
+    template = "\\1=" + (redaction + separator).replace("\\", "\\\\")
+    return lambda message: pattern.sub(template, message)
+
+
+@lru_cache(maxsize=256)
+def _redacted_template(fields: Tuple[str, ...], redaction: str,
+                       separator: str, template: str) -> str:
+    """Redact the text of a message template, once per template"""
+    return _redactor(fields, redaction, separator)(template)
+
+
+class RedactionStats:
+    """
+    Counters and timers of the redaction hot path
+    Disabled by default: enable() it, or set PERSONAL_DATA_REDACTION_STATS
+    to 1, and read it with snapshot(). The time percentiles are computed
+    on the last `samples` redactions.
+    """
+
+    def __init__(self, enabled: bool = False, samples: int = 1024):
+        self.enabled = enabled
+        self._samples = samples
+        self._lock = threading.Lock()
+        self._dumper = None
+        self.reset()
+
+    def enable(self) -> None:
+        """Start counting"""
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Stop counting, the counters are kept"""
+        self.enabled = False
+
+    def reset(self) -> None:
+        """Set every counter back to zero"""
+        with self._lock:
+            self.records = 0
+            self.redactions = Counter()
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.time_ns = 0
+            self.times_ns = deque(maxlen=self._samples)
+
+    def add(self, message: str, redacted: str, fields: Iterable[str],
+            elapsed_ns: Optional[int], record: bool = False) -> None:
+        """
+        Count one redaction, and one formatted record if record
+        A redaction served from a cache has no elapsed_ns (None): it
+        is left out of the time samples.
+        """
+        with self._lock:
+            self.records += record
+            self.redactions.update(fields)
+            self.bytes_in += len(message.encode())
+            self.bytes_out += len(redacted.encode())
+            if elapsed_ns is not None:
+                self.time_ns += elapsed_ns
+                self.times_ns.append(elapsed_ns)
+
+    def snapshot(self) -> Dict:
+        """Return a copy of the counters as a JSON-ready dict"""
+        with self._lock:
+            times = sorted(self.times_ns)
+            percentiles = {
+                "p{}".format(p): times[min(len(times) - 1,
+                                           len(times) * p // 100)]
+                for p in (50, 90, 99)} if times else {}
+            return {
+                "records": self.records,
+                "redactions": dict(self.redactions),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "time_ns": self.time_ns,
+                "time_percentiles_ns": percentiles,
+            }
+
+    def dump(self, file_path: str) -> None:
+        """Write a snapshot to a file, as JSON"""
+        snapshot = dict(self.snapshot(), timestamp=time.time())
+        with open(file_path, "w") as f:
+            json.dump(snapshot, f)
+
+    def start_dumping(self, file_path: str, interval: float) -> None:
+        """Dump a snapshot to file_path every interval seconds"""
+        def run():
+            while not stop.wait(interval):
+                self.dump(file_path)
+        stop = threading.Event()
+        self._dumper = stop
+        threading.Thread(target=run, name="redaction-stats",
+                         daemon=True).start()
+        atexit.register(self.dump, file_path)
+
+    def stop_dumping(self) -> None:
+        """Stop the periodic dumps"""
+        if self._dumper is not None:
+            self._dumper.set()
+            self._dumper = None
+
+
+REDACTION_STATS = RedactionStats(
+    enabled=os.getenv('PERSONAL_DATA_REDACTION_STATS') == '1')
+
+
+def _timed_redact(redact: Callable[[str], str], pattern: "re.Pattern",
+                  message: str, record: bool = False) -> str:
+    """Redact a message and count it in REDACTION_STATS"""
+    start = time.perf_counter_ns()
+    redacted = redact(message)
+    elapsed = time.perf_counter_ns() - start
+    # counted after the timer: only the redaction itself is timed
+    fields = pattern.findall(redacted) if pattern is not None else ()
+    REDACTION_STATS.add(message, redacted, fields, elapsed, record)
+    return redacted
+
 
 def filter_datum(fields: List[str], redaction: str, message: str,
                  separator: str) -> str:
     """Obfuscates sensitive data in a log message."""
-    for f in fields:
-        message = re.sub("{}=.*?{}".format(f, separator),
-                         "{}={}{}".format(f, redaction, separator), message)
-    return message
+    redact = _redactor(tuple(fields), redaction, separator)
+    if REDACTION_STATS.enabled:
+        pattern = _compiled(tuple(fields), separator) if fields else None
+        return _timed_redact(redact, pattern, message)
+    return redact(message)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -70,84 +256,767 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], cache_size: int = 0):
+        """
+        Args:
+            fields: the PII fields to redact
+            cache_size: the number of redacted messages kept in an LRU
+                cache so that a repeated message is not redacted again,
+                0 to disable it
+        """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self._field_set = frozenset(fields)
+        # compiled once per formatter, shared with filter_datum's cache
+        self._redact = _redactor(tuple(fields), self.REDACTION,
+                                 self.SEPARATOR)
+        self._pattern = _compiled(tuple(fields), self.SEPARATOR) \
+            if fields else None
+        self.cache_size = cache_size
+        # keyed by the unredacted message: it only ever lives in memory
+        self._cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+
+    def __getstate__(self) -> dict:
+        """Never copy nor pickle the cache, its keys are not redacted"""
+        state = self.__dict__.copy()
+        state["_cache"] = OrderedDict()
+        return state
+
+    def cache_info(self) -> Dict[str, int]:
+        """Return the statistics of the redacted messages cache"""
+        return {"size": len(self._cache), "max_size": self.cache_size,
+                "hits": self.cache_hits, "misses": self.cache_misses,
+                "evictions": self.cache_evictions}
+
+    def clear_cache(self) -> None:
+        """Empty the redacted messages cache"""
+        self._cache.clear()
+
+    def _redact_cached(self, message: str) -> str:
+        """Redact a message through the LRU cache"""
+        entry = self._cache.get(message)
+        if entry is not None:
+            self.cache_hits += 1
+            self._cache.move_to_end(message)
+            redacted, fields = entry
+            if REDACTION_STATS.enabled:
+                if fields is None:
+                    # cached while the stats were disabled
+                    fields = self._fields_of(redacted)
+                    self._cache[message] = (redacted, fields)
+                REDACTION_STATS.add(message, redacted, fields, None, True)
+            return redacted
+        self.cache_misses += 1
+        fields = None
+        if REDACTION_STATS.enabled:
+            redacted = _timed_redact(self._redact, self._pattern, message,
+                                     True)
+            fields = self._fields_of(redacted)
+        else:
+            redacted = self._redact(message)
+        # the redacted fields are kept to count them again on a hit
+        self._cache[message] = (redacted, fields)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            self.cache_evictions += 1
+        return redacted
+
+    def _fields_of(self, redacted: str) -> Tuple[str, ...]:
+        """Return the fields redacted in a message"""
+        if self._pattern is None:
+            return ()
+        return tuple(self._pattern.findall(redacted))
 
     def format(self, record: logging.LogRecord) -> str:
-        """Filters values in incoming log records"""
-        return (filter_datum(self.fields, self.REDACTION,
-                             super(RedactingFormatter, self).format(record),
-                             self.SEPARATOR))
+        """
+        Filters values in incoming log records
+        Structured records, logged with a dict as argument or with
+        `extra` fields, are redacted by key: the regex only runs on
+        their message text. Any other record is formatted then redacted
+        by filter_datum, and so is any line holding a traceback or a
+        stack, whose text can only be redacted once formatted.
+        """
+        traced = record.exc_info or record.exc_text or record.stack_info
+        extra = record.__dict__.keys() - RECORD_ATTRS
+        if extra or isinstance(record.args, Mapping):
+            if traced:
+                message = super(RedactingFormatter, self).format(
+                    self._redact_structured(record, extra))
+                if REDACTION_STATS.enabled:
+                    return _timed_redact(self._redact, self._pattern,
+                                         message, True)
+                return self._redact(message)
+            if REDACTION_STATS.enabled:
+                return self._timed_structured(record, extra)
+            return super(RedactingFormatter, self).format(
+                self._redact_structured(record, extra))
+        if self.cache_size > 0 and not traced:
+            # keyed on the message alone: the header changes with the
+            # time and holds no `field=...;` pair to redact
+            record = copy.copy(record)
+            record.msg = self._redact_cached(record.getMessage())
+            record.args = None
+            return super(RedactingFormatter, self).format(record)
+        message = super(RedactingFormatter, self).format(record)
+        if REDACTION_STATS.enabled:
+            return _timed_redact(self._redact, self._pattern, message, True)
+        return self._redact(message)
+
+    def _timed_structured(self, record: logging.LogRecord,
+                          extra: set) -> str:
+        """Format a structured record and count it in REDACTION_STATS"""
+        start = time.perf_counter_ns()
+        redacted = self._redact_structured(record, extra)
+        elapsed = time.perf_counter_ns() - start
+        keys = set(extra)
+        if isinstance(record.args, Mapping):
+            keys.update(record.args)
+        message = super(RedactingFormatter, self).format(redacted)
+        # the message is built redacted: bytes in and out are the same
+        REDACTION_STATS.add(message, message, keys & self._field_set,
+                            elapsed, True)
+        return message
+
+    def _redact_value(self, key: str, value):
+        """
+        Return the redacted value of a field: the REDACTION for a PII
+        key, else the value, run through the regex only when its text
+        could hold a `field=...;` pair
+        """
+        if key in self._field_set:
+            return self.REDACTION
+        text = str(value)
+        return self._redact(text) if "=" in text else value
+
+    def _serialize(self, values: Mapping) -> str:
+        """Serialize fields as `key=value;` pairs, PII ones redacted"""
+        return " ".join("{}={}{}".format(
+            key, self._redact_value(key, value), self.SEPARATOR)
+            for key, value in values.items())
+
+    def _redact_structured(self, record: logging.LogRecord,
+                           extra: set) -> logging.LogRecord:
+        """
+        Return a copy of a structured record with its message built
+        from redacted values
+        A dict argument fills the %(key)s placeholders of the message,
+        or is serialized when the message is empty. `extra` fields are
+        serialized after the message. Only the parts built from the
+        dicts skip the regex: the message text is always redacted.
+        """
+        if isinstance(record.args, Mapping):
+            if record.msg:
+                message = _redacted_template(
+                    tuple(self.fields), self.REDACTION, self.SEPARATOR,
+                    str(record.msg)) % {
+                        key: self._redact_value(key, value)
+                        for key, value in record.args.items()}
+            else:
+                message = self._serialize(record.args)
+        else:
+            message = self._redact(record.getMessage())
+        if extra:
+            fields = {key: getattr(record, key) for key in sorted(extra)}
+            message = " ".join(filter(None, (message,
+                                             self._serialize(fields))))
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        return record
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler on a bounded queue
+    When the queue is full the record either waits for room ("block")
+    or is discarded and counted in `dropped` ("drop").
+    """
+
+    def __init__(self, log_queue: queue.Queue, policy: str = "block"):
+        super(BoundedQueueHandler, self).__init__(log_queue)
+        if policy not in ("block", "drop"):
+            raise ValueError("unknown queue policy: {}".format(policy))
+        self.policy = policy
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Prepare a record for the queue
+        Dict arguments are kept as they are, so that the formatter can
+        redact them by key instead of parsing the merged message.
+        """
+        if isinstance(record.args, Mapping):
+            return copy.copy(record)
+        return super(BoundedQueueHandler, self).prepare(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Put a record on the queue according to the policy"""
+        if self.policy == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogStormFilter(logging.Filter):
+    """
+    Drop the records of a log storm before they are formatted
+    Args:
+        rate: records per second allowed for each message template at
+            each level (0: no limit), up to `burst` at once
+        window: seconds during which a message identical to a logged
+            one is suppressed (0: no suppression); once the window is
+            over, a copy of the last suppressed record says how many
+            repeats were suppressed
+        sample: {level: probability of keeping a record of that level}
+    The dropped records never reach RedactingFormatter; they are
+    counted in `dropped` by reason.
+    """
+
+    # the number of keys remembered, the least recently used go first
+    MAX_KEYS = 10000
+
+    def __init__(self, rate: float = 0, window: float = 0,
+                 sample: Dict[int, float] = None, burst: float = None):
+        super(LogStormFilter, self).__init__()
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.window = window
+        self.sample = sample or {}
+        self.dropped = Counter()
+        # key -> (tokens, last refill), least recently used first
+        self._buckets = OrderedDict()
+        # key -> [window start, suppressed, last suppressed record],
+        # in window start order
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Tell if a record is logged"""
+        probability = self.sample.get(record.levelno)
+        if probability is not None and random.random() >= probability:
+            self.dropped["sampled"] += 1
+            return False
+        now = time.monotonic()
+        keep = True
+        summaries = []
+        with self._lock:
+            if self.rate and not self._take_token(record, now):
+                self.dropped["rate"] += 1
+                keep = False
+            elif self.window:
+                summaries = self._expire(now)
+                keep = self._deduplicate(record, now)
+        self._emit(summaries)
+        return keep
+
+    def _take_token(self, record: logging.LogRecord, now: float) -> bool:
+        """Refill the token bucket of the record key and take a token"""
+        # str: a message may be any object, a dict is not hashable
+        key = (record.name, record.levelno, str(record.msg))
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if len(self._buckets) >= self.MAX_KEYS:
+            # the other keys keep their limits mid-storm
+            self._buckets.popitem(last=False)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return False
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+    def _deduplicate(self, record: logging.LogRecord, now: float) -> bool:
+        """Suppress a message logged less than `window` seconds ago"""
+        key = (record.name, record.levelno, record.getMessage())
+        seen = self._seen.get(key)
+        if seen is not None:
+            seen[1] += 1
+            seen[2] = record
+            self.dropped["duplicate"] += 1
+            self._start_sweeper()
+            return False
+        self._seen[key] = [now, 0, None]
+        return True
+
+    def _expire(self, now: float, everything: bool = False) -> list:
+        """
+        Forget the keys whose window is over, or every key, and return
+        the summary records of their suppressed repeats
+        """
+        summaries = []
+        while self._seen:
+            key, (start, suppressed, record) = next(iter(
+                self._seen.items()))
+            if not everything and now - start < self.window and \
+                    len(self._seen) <= self.MAX_KEYS:
+                break
+            del self._seen[key]
+            if suppressed:
+                summary = copy.copy(record)
+                summary.msg = "{} ({} repeats suppressed)".format(
+                    record.msg, suppressed)
+                summaries.append(summary)
+        return summaries
+
+    @staticmethod
+    def _emit(summaries: list) -> None:
+        """Hand summary records to the handlers of their logger"""
+        for summary in summaries:
+            # past the logger filters: this one already let it through
+            logging.getLogger(summary.name).callHandlers(summary)
+
+    def flush(self) -> None:
+        """Emit the summaries of every suppressed repeat now"""
+        with self._lock:
+            summaries = self._expire(time.monotonic(), everything=True)
+        self._emit(summaries)
+
+    def _start_sweeper(self) -> None:
+        """
+        Start the thread emitting the summaries of the windows that end
+        while no other record is logged
+        """
+        if self._sweeper is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.window)
+                with self._lock:
+                    summaries = self._expire(time.monotonic())
+                self._emit(summaries)
+        self._sweeper = threading.Thread(target=run, name="log-storm",
+                                         daemon=True)
+        self._sweeper.start()
+
+
+def _storm_filter() -> Optional[LogStormFilter]:
+    """
+    Build the LogStormFilter of the user_data logger from
+    PERSONAL_DATA_LOG_RATE, PERSONAL_DATA_LOG_DEDUP_WINDOW and
+    PERSONAL_DATA_LOG_SAMPLE ("DEBUG=0.01,INFO=0.1"), None if unset
+    """
+    rate = float(os.getenv('PERSONAL_DATA_LOG_RATE', 0))
+    window = float(os.getenv('PERSONAL_DATA_LOG_DEDUP_WINDOW', 0))
+    sample = {}
+    for item in filter(None, os.getenv('PERSONAL_DATA_LOG_SAMPLE',
+                                       '').split(',')):
+        level, probability = item.split('=')
+        levelno = logging.getLevelName(level.strip().upper())
+        # an unknown name gives back the string "Level <name>"
+        if not isinstance(levelno, int):
+            raise ValueError("unknown log level in PERSONAL_DATA_LOG_SAMPLE:"
+                             " {}".format(level))
+        sample[levelno] = float(probability)
+    if not (rate or window or sample):
+        return None
+    return LogStormFilter(rate, window, sample)
+
+
+# the user_data listener, started once by the first get_logger call
+_listener = None
+_logger_lock = threading.Lock()
+
+
+def _stop_listener() -> None:
+    """Drain the queue and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 
 def get_logger() -> logging.Logger:
-    """Retur a logging.Logger object"""
-    # logger = logging.getLogger('user_data')
-    # logger.setLevel(logging.INFO)
-    # logger.propagate = False
-    # handler = logging.StreamHandler()
-    # handler.setFormatter(RedactingFormatter(PII_FIELDS))
-    # logger.addHandler(handler)
-    # return logger
-    # OR :
-    logger = logging.Logger(name="user_data")
-    logger.setLevel = logging.INFO
-    logger.propagate = False
-    handler = logging.StreamHandler()
-    handler.setFormatter(RedactingFormatter(PII_FIELDS))
-    logger.addHandler(handler)
+    """
+    Return the "user_data" logging.Logger object
+    The logger is built once: records are pushed on a bounded queue and
+    a QueueListener thread does the redaction and the stream writes.
+    PERSONAL_DATA_LOG_QUEUE_SIZE sets the queue size and
+    PERSONAL_DATA_LOG_QUEUE_POLICY ("block" or "drop") what happens
+    when it is full, and PERSONAL_DATA_LOG_CACHE_SIZE the size of the
+    formatter redacted messages cache. A LogStormFilter is added when it
+    is configured.
+    """
+    global _listener
+    logger = logging.getLogger("user_data")
+    with _logger_lock:
+        if _listener is not None:
+            return logger
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        storm_filter = _storm_filter()
+        if storm_filter is not None:
+            # on the logger: the records are dropped before the queue
+            logger.addFilter(storm_filter)
+        queue_size = int(os.getenv('PERSONAL_DATA_LOG_QUEUE_SIZE', 10000))
+        policy = os.getenv('PERSONAL_DATA_LOG_QUEUE_POLICY', 'block')
+        log_queue = queue.Queue(maxsize=queue_size)
+        handler = logging.StreamHandler()
+        cache_size = int(os.getenv('PERSONAL_DATA_LOG_CACHE_SIZE', 0))
+        handler.setFormatter(RedactingFormatter(PII_FIELDS, cache_size))
+        _listener = logging.handlers.QueueListener(log_queue, handler)
+        _listener.start()
+        logger.addHandler(BoundedQueueHandler(log_queue, policy))
+        atexit.register(_stop_listener)
+        if storm_filter is not None:
+            # registered last so it runs first: before the queue drains
+            atexit.register(storm_filter.flush)
+        stats_file = os.getenv('PERSONAL_DATA_REDACTION_STATS_FILE')
+        if stats_file and REDACTION_STATS.enabled:
+            REDACTION_STATS.start_dumping(stats_file, float(os.getenv(
+                'PERSONAL_DATA_REDACTION_STATS_INTERVAL', 60)))
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
+class SQLiteCursor:
+    """DB-API cursor accepting the MySQL "%s" placeholders"""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def execute(self, operation: str, params: tuple = ()) -> None:
+        """Run a query written for mysql.connector"""
+        self._cursor.execute(operation.replace("%s", "?"), params or ())
+
+    def __getattr__(self, name: str):
+        # fetchone, fetchmany, fetchall, close, description...
+        return getattr(self._cursor, name)
+
+
+class SQLiteConnection:
     """
-    A function that returns a connector to the database
-    Args:
-        None
-    Returns:
-        mysql.connector.connection.MySQLConnection:
-            A connector to the database
+    Local stand-in for a MySQLConnection backed by a SQLite file
+    It answers the calls main and the exports make on a connection,
+    so they run without a MySQL server.
+    """
+
+    def __init__(self, database: str):
+        self._conn = sqlite3.connect(database, check_same_thread=False)
+
+    def cursor(self, buffered: bool = None) -> SQLiteCursor:
+        """Return a new cursor, sqlite3 cursors are never buffered"""
+        return SQLiteCursor(self._conn.cursor())
+
+    def is_connected(self) -> bool:
+        """Check the connection is still usable"""
+        try:
+            self._conn.execute("SELECT 1")
+        except sqlite3.Error:
+            return False
+        return True
+
+    def ping(self, reconnect: bool = False, attempts: int = 1,
+             delay: int = 0) -> None:
+        """Raise if the connection is not usable"""
+        if not self.is_connected():
+            raise sqlite3.OperationalError("connection is closed")
+
+    def commit(self) -> None:
+        """Commit the current transaction"""
+        self._conn.commit()
+
+    def close(self) -> None:
+        """Close the connection"""
+        self._conn.close()
+
+
+# the connection pool of the current process
+_pool = None
+_pool_pid = None
+
+
+def _get_pool() -> "mysql.connector.pooling.MySQLConnectionPool":
     """
-    try:
+    Return the pool of connections of this process
+    A forked worker does not reuse the sockets of its parent: it
+    builds its own pool on first use.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
         # Obtain database credentials from environment variables
         db_user = os.getenv('PERSONAL_DATA_DB_USERNAME', 'root')
         db_password = os.getenv('PERSONAL_DATA_DB_PASSWORD', 'Remisql@91')
         db_host = os.getenv('PERSONAL_DATA_DB_HOST', 'localhost')
         db_name = os.getenv('PERSONAL_DATA_DB_NAME', 'my_db')
-        # Establish connection to the database
-        conn = mysql.connector.connection.MySQLConnection(
+        pool_size = int(os.getenv('PERSONAL_DATA_DB_POOL_SIZE', 5))
+        _pool = mysql.connector.pooling.MySQLConnectionPool(
+            pool_name="personal_data_{}".format(os.getpid()),
+            pool_size=pool_size,
             host=db_host,
             user=db_user,
             password=db_password,
             database=db_name
         )
-        return conn
-    except mysql.connector.ConnectionError:
-        return None
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def get_db() -> "mysql.connector.connection.MySQLConnection":
+    """
+    A function that returns a connector to the database
+    Args:
+        None
+    Returns:
+        mysql.connector.connection.MySQLConnection:
+            A connector to the database, taken from the pool of
+            PERSONAL_DATA_DB_POOL_SIZE connections (closing it gives it
+            back). Once PERSONAL_DATA_DB_RETRIES attempts failed,
+            the mysql.connector.Error of the last one is raised.
+    With PERSONAL_DATA_DB_BACKEND set to "sqlite", a SQLiteConnection
+    on the file PERSONAL_DATA_DB_NAME is returned instead. Any other
+    backend needs mysql-connector-python: ImportError is raised when it
+    is not installed.
+    """
+    if os.getenv('PERSONAL_DATA_DB_BACKEND') == 'sqlite':
+        return SQLiteConnection(os.getenv('PERSONAL_DATA_DB_NAME', 'my_db'))
+    if mysql is None:
+        raise ImportError("mysql-connector-python is not installed, "
+                          "set PERSONAL_DATA_DB_BACKEND=sqlite to use "
+                          "a SQLite database instead")
+    retries = int(os.getenv('PERSONAL_DATA_DB_RETRIES', 3))
+    for attempt in range(retries + 1):
+        conn = None
+        try:
+            conn = _get_pool().get_connection()
+            # pre-ping: never hand out a connection the server dropped
+            conn.ping(reconnect=True, attempts=1, delay=0)
+            return conn
+        except mysql.connector.Error:
+            if conn is not None:
+                conn.close()
+            if attempt == retries:
+                raise
+            # back off: 0.1s, 0.2s, 0.4s...
+            time.sleep(0.1 * 2 ** attempt)
+
+
+def fetch_rows(cursor, batch_size: int) -> Iterator[tuple]:
+    """
+    Stream the rows of an executed query batch by batch
+    Args:
+        cursor: a cursor on which a query has been executed
+        batch_size: the number of rows fetched per round trip
+    Returns:
+        an iterator over the rows, holding at most one batch in memory
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def _users_query() -> str:
+    """Return the SELECT statement on the users table"""
+    return "SELECT {} FROM users".format(", ".join(DB_FIELDS))
+
+
+def _partitions(workers: int, row_limit: int = 0) -> List[tuple]:
+    """
+    Split the users table into ranges, one query suffix per range
+    With PERSONAL_DATA_PARTITION_KEY naming a numeric primary key, the
+    table is split on ranges of that key: each range is read through
+    its index, and with a row_limit the last one ends at the
+    row_limit-th key. Any other table is split on row numbers, ordered
+    by every selected column so the ranges are stable.
+    """
+    key = os.getenv('PERSONAL_DATA_PARTITION_KEY')
+    # a few ranges per worker keep them all busy until the end
+    count = workers * 4
+    db = get_db()
+    # buffered: a second query runs on the cursor
+    cursor = db.cursor(buffered=True)
+    low = high = None
+    if key:
+        cursor.execute("SELECT MIN({0}), MAX({0}) FROM users".format(key))
+        low, high = cursor.fetchone()
+        if not all(type(v) is int for v in (low, high)):
+            # an empty table, or a key with no integer ranges
+            key = None
+        elif row_limit > 0:
+            cursor.execute("SELECT {0} FROM users ORDER BY {0} "
+                           "LIMIT 1 OFFSET %s".format(key), (row_limit - 1,))
+            last = cursor.fetchone()
+            if last is not None:
+                high = last[0]
+    if not key:
+        cursor.execute("SELECT COUNT(*) FROM users")
+        low, high = 0, cursor.fetchone()[0] - 1
+        if row_limit > 0:
+            high = min(high, row_limit - 1)
+    cursor.close()
+    db.close()
+    if high < low:
+        return []
+    step = -(-(high - low + 1) // count)
+    if key:
+        suffix = " WHERE {0} >= %s AND {0} < %s ORDER BY {0}".format(key)
+        return [(suffix, (start, min(start + step, high + 1)))
+                for start in range(low, high + 1, step)]
+    suffix = " ORDER BY {} LIMIT %s OFFSET %s".format(", ".join(DB_FIELDS))
+    return [(suffix, (min(step, high + 1 - start), start))
+            for start in range(0, high + 1, step)]
+
+
+def _export_partition(partition: tuple) -> str:
+    """
+    Read one range over its own connection and redact its rows into a
+    temporary file, streamed: return the path of the file
+    """
+    suffix, params = partition
+    batch_size = int(os.getenv('PERSONAL_DATA_BATCH_SIZE', 1000))
+    formatter = RedactingFormatter(PII_FIELDS)
+    db = get_db()
+    cursor = db.cursor(buffered=False)
+    cursor.execute(_users_query() + suffix, params)
+    with tempfile.NamedTemporaryFile("w", prefix="user_data-",
+                                     suffix=".part", delete=False) as out:
+        for row in fetch_rows(cursor, batch_size):
+            record = logging.LogRecord(
+                "user_data", logging.INFO, __file__, 0, ROW_TEMPLATE,
+                (dict(zip(DB_FIELDS, row)),), None)
+            out.write(formatter.format(record) + "\n")
+    cursor.close()
+    db.close()
+    return out.name
+
+
+def export_parallel(workers: int, row_limit: int = 0,
+                    stream: Optional[TextIO] = None) -> None:
+    """
+    Export the users table redacted, with one process per range
+    Args:
+        workers: the number of worker processes (and connections)
+        row_limit: the maximum number of rows exported, 0 for all
+        stream: where the lines are written, sys.stderr by default
+    The ranges are written back in table order whatever the
+    order in which the workers finish. Each worker spools its range to
+    a temporary file, which the merge stage copies to the stream and
+    deletes; at most twice `workers` ranges are in flight, so memory
+    stays bounded whatever the table size and the stream speed.
+    """
+    stream = stream or sys.stderr
+    partitions = iter(_partitions(workers, row_limit))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque(pool.submit(_export_partition, partition)
+                        for partition in islice(partitions, 2 * workers))
+        # popped in submission order: that is the merge stage
+        while pending:
+            part_path = pending.popleft().result()
+            for partition in islice(partitions, 1):
+                pending.append(pool.submit(_export_partition, partition))
+            try:
+                with open(part_path) as part:
+                    shutil.copyfileobj(part, stream)
+            finally:
+                os.remove(part_path)
+    stream.flush()
+
+
+def fetch_blocks(cursor, batch_size: int) -> Iterator[list]:
+    """
+    Stream the rows of an executed query as column-oriented blocks
+    Returns:
+        an iterator over lists of columns, batch_size rows long at most
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield list(zip(*rows))
+
+
+def mask_block(columns: list, fields: Tuple[str, ...] = PII_FIELDS,
+               redaction: str = RedactingFormatter.REDACTION,
+               separator: str = RedactingFormatter.SEPARATOR) -> Iterable:
+    """
+    Redact the PII columns of a block of DB_FIELDS columns
+    Returns:
+        the rows of the block, with every PII value replaced as a whole
+        column, and the `field=...;` pairs held in the other string
+        columns redacted as filter_datum does, column by column
+    """
+    redact = _redactor(tuple(fields), redaction, separator)
+    columns = list(columns)
+    for i, name in enumerate(DB_FIELDS):
+        if name in fields:
+            columns[i] = (redaction,) * len(columns[i])
+        elif any(type(v) is str and "=" in v for v in columns[i]):
+            columns[i] = tuple(redact(v) if type(v) is str else v
+                               for v in columns[i])
+    return zip(*columns)
+
+
+def export_columnar(out: TextIO, fmt: str = "csv", batch_size: int = 1000,
+                    row_limit: int = 0) -> None:
+    """
+    Export the users table redacted as CSV or NDJSON
+    Args:
+        out: where the export is written
+        fmt: "csv" (with a header line) or "ndjson"
+        batch_size: the number of rows per block
+        row_limit: the maximum number of rows exported, 0 for all
+    The PII columns are masked by position: no row is ever formatted
+    as a `name=...;` message nor scanned by filter_datum.
+    """
+    if fmt not in ("csv", "ndjson"):
+        raise ValueError("unknown export format: {}".format(fmt))
+    db = get_db()
+    cursor = db.cursor(buffered=False)
+    if row_limit > 0:
+        cursor.execute(_users_query() + " LIMIT %s", (row_limit,))
+    else:
+        cursor.execute(_users_query())
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(DB_FIELDS)
+    for columns in fetch_blocks(cursor, batch_size):
+        rows = mask_block(columns)
+        if fmt == "csv":
+            writer.writerows(rows)
+        else:
+            out.writelines(json.dumps(dict(zip(DB_FIELDS, row)),
+                                      default=str) + "\n" for row in rows)
+    out.flush()
+    cursor.close()
+    db.close()
 
 
 def main():
     """Main function"""
+    # batching is set from the environment, like the db credentials
+    batch_size = int(os.getenv('PERSONAL_DATA_BATCH_SIZE', 1000))
+    row_limit = int(os.getenv('PERSONAL_DATA_ROW_LIMIT', 0))
+    workers = int(os.getenv('PERSONAL_DATA_EXPORT_WORKERS', 1))
+    export_format = os.getenv('PERSONAL_DATA_EXPORT_FORMAT')
+    if export_format:
+        export_columnar(sys.stdout, export_format, batch_size, row_limit)
+        return
+    if workers > 1:
+        export_parallel(workers, row_limit)
+        return
     # establish db connection
     db = get_db()
-    cursor = db.cursor()
+    # unbuffered: rows stay on the server until fetched
+    cursor = db.cursor(buffered=False)
     # create our logging object
     logger = get_logger()
     # query db
-    db_fields = "name, email, phone, ssn, password, ip, last_login, user_agent"
-    query = "SELECT {} FROM users".format(db_fields)
-    cursor.execute(query)
-    data = cursor.fetchall()
-    # create the fmt variable needed for our logging.Formatter class
-    fmt = "name={}; email={}; phone={}; ssn={}; password={};" + \
-          "ip={}; last_login={}; user_agent={}"
-    # fill the fmt variable with the data from the db
-    for row in data:
-        fmt = fmt.format(row[0], row[1], row[2], row[3], row[4], row[5],
-                         row[6], row[7])
+    query = _users_query()
+    if row_limit > 0:
+        cursor.execute(query + " LIMIT %s", (row_limit,))
+    else:
+        cursor.execute(query)
+    # stream the rows to the logger, which redacts them by column name
+    for row in fetch_rows(cursor, batch_size):
         # log the data
-        logger.info(fmt)
+        logger.info(ROW_TEMPLATE, dict(zip(DB_FIELDS, row)))
     # close cursor
     cursor.close()
     # close
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Redact existing log files offline
+Usage: ./redact_logs.py [-o OUTPUT] [--workers N] LOGFILE
+The file is memory-mapped, split in chunks on line boundaries and the
+chunks are redacted as bytes by a pool of processes, with the same
+PII_FIELDS and filter_datum rules as the user_data logger. The lines
+are written in their original order, to OUTPUT or to stdout.
+"""
+import argparse
+import mmap
+import os
+import re
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from typing import BinaryIO, List, Tuple
+
+from filtered_logger import PII_FIELDS, RedactingFormatter, redaction_pattern
+
+
+# set in each worker process by _init_worker
+_pattern = None
+_template = None
+
+
+def _init_worker(fields: Tuple[str, ...], redaction: str,
+                 separator: str) -> None:
+    """Compile the bytes redaction pattern once per worker"""
+    global _pattern, _template
+    _pattern = re.compile(redaction_pattern(fields, separator).encode())
+    _template = b"\\1=" + (redaction + separator).encode().replace(
+        b"\\", b"\\\\")
+
+
+def _redact_chunk(chunk: Tuple[str, int, int]) -> bytes:
+    """Redact the bytes from start to end of a file"""
+    file_path, start, end = chunk
+    with open(file_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _pattern.sub(_template, mm[start:end])
+
+
+def chunks(file_path: str, chunk_size: int) -> List[Tuple[str, int, int]]:
+    """
+    Split a file in chunks of about chunk_size bytes
+    Every chunk but the last ends right after a newline, so no line is
+    ever split between two workers.
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return []
+    chunk_size = max(chunk_size, 1)
+    result = []
+    with open(file_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < size:
+                end = mm.find(b"\n", min(start + chunk_size, size) - 1)
+                end = size if end == -1 else end + 1
+                result.append((file_path, start, end))
+                start = end
+    return result
+
+
+def redact_file(file_path: str, out: BinaryIO, workers: int = None,
+                chunk_size: int = 1 << 24,
+                fields: Tuple[str, ...] = PII_FIELDS,
+                redaction: str = RedactingFormatter.REDACTION,
+                separator: str = RedactingFormatter.SEPARATOR) -> None:
+    """
+    Redact a log file into a binary stream
+    Args:
+        file_path: the log file to redact
+        out: where the redacted lines are written
+        workers: the number of processes, os.cpu_count() by default
+        chunk_size: the approximate size of the chunks, in bytes
+        fields, redaction, separator: the filter_datum rules
+    At most twice `workers` chunks are in flight, so a slow output
+    never makes the redacted file pile up in memory.
+    """
+    workers = workers or os.cpu_count() or 1
+    initargs = (tuple(fields), redaction, separator)
+    todo = iter(chunks(file_path, chunk_size))
+    with Pool(workers, _init_worker, initargs) as pool:
+        pending = deque(pool.apply_async(_redact_chunk, (chunk,))
+                        for chunk in islice(todo, 2 * workers))
+        # popped in chunk order whatever the worker finishing order
+        while pending:
+            data = pending.popleft().get()
+            for chunk in islice(todo, 1):
+                pending.append(pool.apply_async(_redact_chunk, (chunk,)))
+            out.write(data)
+    out.flush()
+
+
+def main():
+    """Parse the command line and redact the file"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("logfile")
+    parser.add_argument("-o", "--output", help="stdout by default")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk-size", type=int, default=16,
+                        help="chunk size in MiB")
+    parser.add_argument("--fields", default=",".join(PII_FIELDS),
+                        help="comma separated, PII_FIELDS by default")
+    parser.add_argument("--redaction", default=RedactingFormatter.REDACTION)
+    parser.add_argument("--separator", default=RedactingFormatter.SEPARATOR)
+    args = parser.parse_args()
+
+    options = dict(workers=args.workers, chunk_size=args.chunk_size << 20,
+                   fields=tuple(args.fields.split(",")),
+                   redaction=args.redaction, separator=args.separator)
+    if args.output:
+        with open(args.output, "wb") as out:
+            redact_file(args.logfile, out, **options)
+    else:
+        redact_file(args.logfile, sys.stdout.buffer, **options)
+
+
+if __name__ == "__main__":
+    main()
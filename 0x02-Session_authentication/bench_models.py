@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+""" Memory benchmark of the models
+Usage: ./bench_models.py [COUNT ...]
+Builds COUNT users (100000 and 1000000 by default) and UserSessions and
+prints, as JSON, the bytes traced per object, next to the same objects
+stored the former way: in a __dict__ with datetime timestamps.
+"""
+import json
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime
+
+from models.user import User
+from models.user_session import UserSession
+
+
+class DictUser():
+    """ A User as it was stored before __slots__
+    """
+
+    def __init__(self, **kwargs):
+        """ Initialize the same attributes as User
+        """
+        self.id = str(uuid.uuid4())
+        self.created_at = datetime.utcnow()
+        self.updated_at = datetime.utcnow()
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+
+
+def _user_kwargs(i: int) -> dict:
+    """ Attributes of the i-th synthetic user
+    """
+    return {
+        'email': "user{}@example.com".format(i),
+        '_password': uuid.uuid4().hex * 2,
+        'first_name': "First{}".format(i % 500),
+        'last_name': "Last{}".format(i % 2000),
+    }
+
+
+def bytes_per_object(factory, count: int) -> float:
+    """ Average memory traced for each of count objects of factory(i)
+    """
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objs = [factory(i) for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del objs
+    return round(size / count, 1)
+
+
+def main():
+    """ Run the benchmark for each count
+    """
+    counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    factories = {
+        'User': lambda i: User(**_user_kwargs(i)),
+        'DictUser': lambda i: DictUser(**_user_kwargs(i)),
+        'UserSession': lambda i: UserSession(
+            user_id="user{}".format(i % 1000), session_id=str(uuid.uuid4())),
+    }
+    results = []
+    for count in counts:
+        for name, factory in factories.items():
+            results.append({'model': name, 'count': count,
+                            'bytes_per_object': bytes_per_object(factory,
+                                                                 count)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
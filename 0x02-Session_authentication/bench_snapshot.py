@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+""" Startup benchmark of the snapshot formats
+Usage: ./bench_snapshot.py [COUNT ...]
+Writes COUNT users (100000 and 1000000 by default) as a JSON snapshot in
+a temporary directory, converts it to every other format, and prints, as
+JSON, the time User.load_from_file takes in a fresh process for each
+format, with the peak RSS of that process.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+
+from models.base import DATA, SNAPSHOT_FORMATS
+from models.user import User
+
+
+# run in a fresh process: the timing and the peak RSS are its own
+LOADER = """
+import json, resource, sys, time
+from models.base import DATA
+from models.user import User
+start = time.perf_counter()
+User.load_from_file()
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'load_seconds': round(elapsed, 3),
+    'objects': len(DATA['User']),
+    # kilobytes on Linux
+    'peak_rss_mb': round(resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+}))
+"""
+
+
+def write_users(count: int):
+    """ Write count synthetic users to .db_User.json
+    """
+    users = {}
+    for i in range(count):
+        user = User(email="user{}@example.com".format(i),
+                    _password=uuid.uuid4().hex * 2,
+                    first_name="First{}".format(i % 500),
+                    last_name="Last{}".format(i % 2000))
+        users[user.id] = user
+    User.write_snapshot(users, 'json')
+    DATA['User'] = {}
+
+
+def load(fmt: str) -> dict:
+    """ Load the users from a format in a new process
+    """
+    env = dict(os.environ, BASE_SNAPSHOT_FORMAT_USER=fmt,
+               BASE_LAZY_LOAD='0',
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", LOADER], env=env,
+                         check=True, stdout=subprocess.PIPE)
+    return json.loads(out.stdout)
+
+
+def main():
+    """ Run the benchmark for each count
+    """
+    counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for count in counts:
+                write_users(count)
+                for fmt in SNAPSHOT_FORMATS:
+                    if fmt != 'json':
+                        User.convert_snapshot('json', fmt)
+                    result = {'format': fmt, 'count': count,
+                              'file_bytes': os.path.getsize(
+                                  User.snapshot_path(fmt))}
+                    result.update(load(fmt))
+                    results.append(result)
+        finally:
+            os.chdir(cwd)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
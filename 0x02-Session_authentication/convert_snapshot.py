@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+""" Convert the snapshot file of a model to another format
+Usage: ./convert_snapshot.py MODEL SOURCE TARGET
+e.g. ./convert_snapshot.py User json marshal reads .db_User.json and
+writes .db_User.marshal. Set BASE_SNAPSHOT_FORMAT_<MODEL>=TARGET for the
+model to load it; the journal, if any, is replayed on either format.
+"""
+import sys
+
+from models.base import SNAPSHOT_FORMATS
+from models.user import User
+from models.user_session import UserSession
+
+
+MODELS = {cls.__name__: cls for cls in (User, UserSession)}
+
+
+def main():
+    """ Parse the command line and convert the snapshot
+    """
+    if len(sys.argv) != 4 or sys.argv[1] not in MODELS \
+            or sys.argv[2] not in SNAPSHOT_FORMATS \
+            or sys.argv[3] not in SNAPSHOT_FORMATS:
+        print("Usage: {} {{{}}} SOURCE TARGET\nformats: {}".format(
+            sys.argv[0], ",".join(MODELS), ", ".join(SNAPSHOT_FORMATS)),
+            file=sys.stderr)
+        sys.exit(2)
+    MODELS[sys.argv[1]].convert_snapshot(sys.argv[2], sys.argv[3])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,426 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import TypeVar, List, Iterable
-from os import path
+from contextlib import nullcontext
+from os import getenv, path
+import atexit
+import bisect
+import fcntl
 import json
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
 import uuid
 
+from models.storage import SQLiteStorage
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# the timestamps are kept as integer microseconds since EPOCH
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# the attributes of Base stored as timestamps
+TIMESTAMP_ATTRIBUTES = ('created_at', 'updated_at')
 DATA = {}
+# BASE_STORAGE picks where the objects live: "file" keeps them in DATA,
+# persisted to .db_<Class>.json files; "sqlite" delegates get, search,
+# count, all, save and remove to a SQLiteStorage on BASE_SQLITE_PATH
+STORAGE = None
+if getenv('BASE_STORAGE', 'file') == 'sqlite':
+    STORAGE = SQLiteStorage(getenv('BASE_SQLITE_PATH', '.db.sqlite3'))
+# "snapshot": every change rewrites .db_<Class>.json
+# "journal": every change is appended to .db_<Class>.journal, which is
+# compacted into the snapshot once it holds JOURNAL_COMPACT_SIZE changes
+PERSISTENCE = getenv('BASE_PERSISTENCE', 'snapshot')
+JOURNAL_COMPACT_SIZE = int(getenv('BASE_JOURNAL_COMPACT_SIZE', 1000))
+# JOURNAL_SIZES[class name]: the number of changes in its journal
+JOURNAL_SIZES = {}
+# write-behind: with BASE_WRITE_BEHIND_MS > 0, save and remove return at
+# once and the changes of that many milliseconds (or of
+# BASE_WRITE_BEHIND_OPS changes) are written together by a background
+# thread, see Flusher
+WRITE_BEHIND_MS = float(getenv('BASE_WRITE_BEHIND_MS', 0))
+WRITE_BEHIND_OPS = int(getenv('BASE_WRITE_BEHIND_OPS', 1000))
+# lazy load: load_from_file keeps the JSON dict of each object in DATA
+# and builds the object on its first access by get or search
+LAZY_LOAD = getenv('BASE_LAZY_LOAD', '0') == '1'
+# multi-process: with BASE_MULTIPROCESS=1, the files of a class are
+# written under an advisory lock shared by the worker processes, and a
+# worker catches up with a class whenever its files changed since it
+# last read or wrote them: in journal mode by replaying the appended
+# lines only (see Base._refresh); write-behind is then disabled
+MULTIPROCESS = getenv('BASE_MULTIPROCESS', '0') == '1'
+# the formats of the .db_<Class>.<format> snapshot files: "json" is the
+# indented JSON of to_json(True); the binary formats store a table of
+# the attributes, timestamps as integer microseconds, with no parsing
+SNAPSHOT_FORMATS = ('json', 'marshal') + (('msgpack',) if msgpack else ())
+# STAMPS[class name]: the state of its files when last read or written
+STAMPS = {}
+# LOCKS[class name]: the FileLock of its files
+LOCKS = {}
+# INDEXES[class name][attribute]: the Index of that attribute
+INDEXES = {}
+# SORTED_INDEXES[class name][attribute]: the SortedIndex of that
+# attribute, built by its first range or prefix search
+SORTED_INDEXES = {}
+
+
+class Index():
+    """ Hash index of the saved objects of a class on one attribute
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty Index
+        """
+        self.attribute = attribute
+        # value -> ids of the objects having it, in insertion order
+        self.ids = {}
+        # id -> value indexed for it, to update the index on change
+        self.values = {}
+        # False once an unhashable value was met: search must scan
+        self.usable = True
+
+    def add(self, obj_id: str, obj):
+        """ Index an object, or its JSON dict when it is not loaded yet,
+        replacing its previous value
+        """
+        self.discard(obj_id)
+        if type(obj) is dict:
+            value = obj.get(self.attribute)
+        else:
+            value = getattr(obj, self.attribute, None)
+        try:
+            self.ids.setdefault(value, {})[obj_id] = None
+        except TypeError:
+            self.usable = False
+            return
+        self.values[obj_id] = value
+
+    def discard(self, obj_id: str):
+        """ Remove an object from the index
+        """
+        if obj_id not in self.values:
+            return
+        value = self.values.pop(obj_id)
+        ids = self.ids[value]
+        del ids[obj_id]
+        if not ids:
+            del self.ids[value]
+
+    def lookup(self, value) -> Iterable[str]:
+        """ Return the ids of the objects indexed with a value
+        """
+        try:
+            return self.ids.get(value, {}).keys()
+        except TypeError:
+            return ()
+
+    def build(self, objs: Iterable[tuple]):
+        """ Index (id, object) pairs
+        """
+        for obj_id, obj in objs:
+            self.add(obj_id, obj)
+
+
+class SortedIndex():
+    """ Sorted index of the saved objects of a class on one attribute
+    It finds the objects with a value in a range, or with a string value
+    starting with a prefix, by bisection: in O(log N + k) for k objects
+    found. Equality lookups stay on the Index of the attribute.
+    """
+
+    def __init__(self, attribute: str, timestamp: bool = False):
+        """ Initialize an empty SortedIndex
+        A timestamp attribute is sorted by its integer microseconds.
+        """
+        self.attribute = attribute
+        self.timestamp = timestamp
+        # (value, id) of the objects valued other than None, sorted
+        self.keys = []
+        # id -> value indexed for it, to update the index on change
+        self.values = {}
+        # False once values that can't be compared were met
+        self.usable = True
+
+    def _value(self, obj):
+        """ Return the value to sort an object, or its JSON dict, by
+        """
+        if type(obj) is dict:
+            value = obj.get(self.attribute)
+            if self.timestamp and value is not None:
+                value = timestamp(value)
+        elif self.timestamp:
+            value = getattr(obj, '_' + self.attribute, None)
+        else:
+            value = getattr(obj, self.attribute, None)
+        return value
+
+    def add(self, obj_id: str, obj):
+        """ Index an object, or its JSON dict when it is not loaded yet,
+        replacing its previous value
+        """
+        self.discard(obj_id)
+        value = self._value(obj)
+        if value is not None:
+            try:
+                bisect.insort(self.keys, (value, obj_id))
+            except TypeError:
+                self.usable = False
+                return
+        self.values[obj_id] = value
+
+    def discard(self, obj_id: str):
+        """ Remove an object from the index
+        """
+        if obj_id not in self.values:
+            return
+        value = self.values.pop(obj_id)
+        if value is not None:
+            del self.keys[bisect.bisect_left(self.keys, (value, obj_id))]
+
+    def build(self, objs: Iterable[tuple]):
+        """ Index (id, object) pairs, sorting them once
+        """
+        for obj_id, obj in objs:
+            value = self._value(obj)
+            if value is not None:
+                self.keys.append((value, obj_id))
+            self.values[obj_id] = value
+        try:
+            self.keys.sort()
+        except TypeError:
+            self.usable = False
+
+    def range(self, low=None, high=None) -> List[str]:
+        """ Return the ids of the objects with low <= value < high, in
+        value order; None is no bound. Bounds that can't be compared
+        with the values match nothing.
+        """
+        keys = self.keys
+        try:
+            start = 0 if low is None else bisect.bisect_left(keys, (low,))
+            end = len(keys) if high is None \
+                else bisect.bisect_left(keys, (high,))
+        except TypeError:
+            return []
+        return [obj_id for _, obj_id in keys[start:end]]
+
+    def prefix(self, prefix: str) -> List[str]:
+        """ Return the ids of the objects with a string value starting
+        with prefix, in value order
+        """
+        if type(prefix) is not str:
+            return []
+        keys = self.keys
+        ids = []
+        try:
+            i = bisect.bisect_left(keys, (prefix,))
+        except TypeError:
+            # the values are no strings
+            return []
+        while i < len(keys) and keys[i][0].startswith(prefix):
+            ids.append(keys[i][1])
+            i += 1
+        return ids
+
+
+class FileLock():
+    """ Advisory lock on a file, shared by the processes using it
+    It is reentrant within a process: the lock is taken on the file by
+    the outermost `with` only.
+    """
+
+    def __init__(self, file_path: str):
+        """ Initialize a FileLock on file_path, created if needed
+        """
+        self.file_path = file_path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        """ Take the lock, waiting for the other processes
+        """
+        self._lock.acquire()
+        if self._depth == 0:
+            self._fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        """ Release the lock
+        """
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+
+class Flusher(threading.Thread):
+    """ Background thread writing the changes of Base classes in groups
+    """
+
+    def __init__(self, window: float, max_ops: int):
+        """ Initialize a Flusher grouping the changes of window seconds
+        or max_ops changes, whichever comes first
+        """
+        super().__init__(name="base-flusher", daemon=True)
+        self.window = window
+        self.max_ops = max_ops
+        self._cond = threading.Condition()
+        # held while a group is taken and written: groups stay in order
+        self._write_lock = threading.Lock()
+        # class -> [(op, obj)] changes waiting to be written
+        self._pending = {}
+        self._ops = 0
+        self._first = None
+
+    def add(self, cls: type, op: str, obj: TypeVar('Base')):
+        """ Queue one change ("put" or "del" of obj) of a class
+        """
+        with self._cond:
+            self._pending.setdefault(cls, []).append((op, obj))
+            self._ops += 1
+            if self._first is None:
+                self._first = time.monotonic()
+                self._cond.notify()
+            elif self._ops >= self.max_ops:
+                self._cond.notify()
+
+    def flush(self):
+        """ Write every queued change now
+        If a write fails, the changes not written go back in front of
+        the queue, and the error is raised.
+        """
+        with self._write_lock:
+            with self._cond:
+                pending = self._pending
+                self._pending = {}
+                self._ops = 0
+                self._first = None
+            written = []
+            try:
+                for cls, changes in pending.items():
+                    cls._write_changes(changes)
+                    written.append(cls)
+            except BaseException:
+                for cls in written:
+                    del pending[cls]
+                self._requeue(pending)
+                raise
+
+    def _requeue(self, pending: dict):
+        """ Put changes back in front of the queued ones
+        """
+        with self._cond:
+            for cls, changes in self._pending.items():
+                pending.setdefault(cls, []).extend(changes)
+            self._pending = pending
+            self._ops = sum(len(changes) for changes in pending.values())
+            if self._first is None:
+                self._first = time.monotonic()
+
+    def run(self):
+        """ Flush each group once its window is over or it is full
+        A failed write is logged and retried with the next group: the
+        thread never stops.
+        """
+        while True:
+            with self._cond:
+                while self._first is None:
+                    self._cond.wait()
+                deadline = self._first + self.window
+                while self._ops < self.max_ops:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "write-behind flush failed, retrying")
+                # a window before retrying, even if the queue is full
+                time.sleep(self.window)
+
+
+# the write-behind Flusher, started by the first change
+FLUSHER = None
+_flusher_lock = threading.Lock()
+
+
+def _get_flusher() -> Flusher:
+    """ Return the Flusher, starting it on first use
+    """
+    global FLUSHER
+    with _flusher_lock:
+        if FLUSHER is None:
+            FLUSHER = Flusher(WRITE_BEHIND_MS / 1000, WRITE_BEHIND_OPS)
+            FLUSHER.start()
+            atexit.register(flush)
+    return FLUSHER
+
+
+def flush():
+    """ Write the changes waiting in the write-behind Flusher
+    """
+    if FLUSHER is not None:
+        FLUSHER.flush()
+
+
+def intern(value):
+    """ Intern a string repeated across objects, return anything else
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+def timestamp(value) -> int:
+    """ Convert a datetime, or its to_json string, to the integer
+    microseconds a timestamp is stored as
+    """
+    if type(value) is str:
+        value = datetime.strptime(value, TIMESTAMP_FORMAT)
+    return (value - EPOCH) // MICROSECOND
 
 
 class Base():
     """ Base class
+    The attributes of the models are __slots__: an object has no
+    __dict__, and its timestamps are stored as integer microseconds.
+    The to_json strings of the timestamps are cached until they change.
     """
+    __slots__ = ('id', '_created_at', '_updated_at', '_timestamps_json')
+    # attributes searched by equality through a hash index: the
+    # indexes are updated by save, remove and load_from_file
+    indexed_attributes = ()
+    # attributes with a SortedIndex for search_range and search_prefix,
+    # built by the first of them and then kept up to date
+    sorted_attributes = ()
+    # the __slots__ of the subclasses, in to_json order
+    _fields = ()
+    # the format of the snapshot, BASE_SNAPSHOT_FORMAT_<CLASS> overrides it
+    snapshot_format = 'json'
+
+    def __init_subclass__(cls, **kwargs):
+        """ Collect the __slots__ of a new model for to_json
+        """
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(
+            name for klass in reversed(cls.__mro__)
+            if issubclass(klass, Base) and klass is not Base
+            for name in klass.__dict__.get('__slots__', ()))
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
@@ -22,6 +428,7 @@ class Base():
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+            self.__class__._reset_indexes()
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
@@ -35,6 +442,32 @@ class Base():
         else:
             self.updated_at = datetime.utcnow()
 
+    @property
+    def created_at(self) -> datetime:
+        """ Creation time, UTC
+        """
+        return EPOCH + self._created_at * MICROSECOND
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Setter of the creation time
+        """
+        self._created_at = (value - EPOCH) // MICROSECOND
+        self._timestamps_json = None
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Last update time, UTC
+        """
+        return EPOCH + self._updated_at * MICROSECOND
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Setter of the last update time
+        """
+        self._updated_at = (value - EPOCH) // MICROSECOND
+        self._timestamps_json = None
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         # sourcery skip: assign-if-exp, reintroduce-else
         """ Equality
@@ -45,67 +478,428 @@ class Base():
             return False
         return (self.id == other.id)
 
+    def _timestamps(self) -> tuple:
+        """ Return the to_json strings of created_at and updated_at
+        strftime is the costly part of to_json: the strings are kept
+        until a timestamp changes.
+        """
+        timestamps = getattr(self, '_timestamps_json', None)
+        if timestamps is None:
+            created = self.created_at.strftime(TIMESTAMP_FORMAT)
+            if self._updated_at == self._created_at:
+                # one string for both, as for a new object
+                updated = created
+            else:
+                updated = self.updated_at.strftime(TIMESTAMP_FORMAT)
+            timestamps = (created, updated)
+            self._timestamps_json = timestamps
+        return timestamps
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
-        result = {}
-        for key, value in self.__dict__.items():
+        created, updated = self._timestamps()
+        result = {
+            'id': self.id,
+            'created_at': created,
+            'updated_at': updated,
+        }
+        for key in self._fields:
             if not for_serialization and key[0] == '_':
                 continue
+            if not hasattr(self, key):
+                continue
+            value = getattr(self, key)
             if type(value) is datetime:
                 result[key] = value.strftime(TIMESTAMP_FORMAT)
             else:
                 result[key] = value
         return result
 
+    @classmethod
+    def _reset_indexes(cls):
+        """ Empty the indexes of the class
+        """
+        INDEXES[cls.__name__] = {attr: Index(attr)
+                                 for attr in cls.indexed_attributes}
+        # built again when they are first searched
+        SORTED_INDEXES[cls.__name__] = {}
+
+    @classmethod
+    def _indexes(cls) -> list:
+        """ Return the indexes to update on a change: the Index of each
+        indexed attribute and the SortedIndex built so far
+        """
+        s_class = cls.__name__
+        return list(INDEXES[s_class].values()) + \
+            list(SORTED_INDEXES[s_class].values())
+
+    @classmethod
+    def _file_lock(cls):
+        """ Return the lock of the files of the class in MULTIPROCESS
+        mode, a context doing nothing otherwise
+        """
+        if not MULTIPROCESS:
+            return nullcontext()
+        s_class = cls.__name__
+        if s_class not in LOCKS:
+            LOCKS.setdefault(s_class, FileLock(".db_{}.lock".format(s_class)))
+        return LOCKS[s_class]
+
+    @classmethod
+    def _stamp(cls) -> tuple:
+        """ Return the state of the snapshot and journal files
+        """
+        stamp = []
+        for file_path in (cls.snapshot_path(),
+                          ".db_{}.journal".format(cls.__name__)):
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                stamp.append(None)
+                continue
+            stamp.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        return tuple(stamp)
+
+    @classmethod
+    def _update_stamp(cls):
+        """ Record the state of the files just read or written
+        """
+        if MULTIPROCESS:
+            STAMPS[cls.__name__] = cls._stamp()
+
+    @classmethod
+    def _refresh(cls):
+        """ Catch up with the changes another process made to the files
+        of the class
+        While the snapshot is the one last read or written, only the
+        journal lines appended since are replayed: the journal size of
+        the stamp is where this process stopped reading it. Anything
+        else, such as a compaction, reloads the class.
+        """
+        if not MULTIPROCESS:
+            return
+        s_class = cls.__name__
+        old = STAMPS.get(s_class)
+        stamp = cls._stamp()
+        if old == stamp:
+            return
+        with cls._file_lock():
+            stamp = cls._stamp()
+            if old is not None and old[0] == stamp[0] and \
+                    stamp[1] is not None and \
+                    (old[1] is None or (old[1][0] == stamp[1][0] and
+                                        old[1][1] <= stamp[1][1])):
+                offset = old[1][1] if old[1] is not None else 0
+                if cls._replay_journal(offset, True):
+                    cls._update_stamp()
+                    return
+            cls.load_from_file()
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
+        The snapshot is read first, then the changes of the journal
+        are replayed on it. With LAZY_LOAD, the objects of a JSON
+        snapshot are only built when they are first accessed; a binary
+        snapshot is cheap enough to be loaded at once. Nothing is
+        loaded with a STORAGE backend: the objects stay in it.
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        if STORAGE is not None:
             return
+        s_class = cls.__name__
+        with cls._file_lock():
+            DATA[s_class] = cls.read_snapshot()
+            JOURNAL_SIZES[s_class] = 0
+            cls._reset_indexes()
+            complete = cls._replay_journal()
+
+            for index in INDEXES[s_class].values():
+                index.build(DATA[s_class].items())
+            # a cut journal is compacted before anything is appended
+            if not complete or \
+                    JOURNAL_SIZES[s_class] >= JOURNAL_COMPACT_SIZE:
+                cls.save_to_file()
+            cls._update_stamp()
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _replay_journal(cls, offset: int = 0,
+                        update_indexes: bool = False) -> bool:
+        """ Apply the changes of the journal from byte offset to DATA,
+        and to the indexes if update_indexes
+        Return False if its last change was cut short by a crash
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        if not path.exists(journal_path):
+            return True
+        indexes = cls._indexes() if update_indexes else ()
+        with open(journal_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("cut line")
+                    change = json.loads(line)
+                except ValueError:
+                    # that change never happened
+                    return False
+                obj_id = change["id"]
+                if change["op"] == "put":
+                    obj = change["obj"]
+                    obj = obj if LAZY_LOAD else cls(**obj)
+                    DATA[s_class][obj_id] = obj
+                    for index in indexes:
+                        index.add(obj_id, obj)
+                else:
+                    DATA[s_class].pop(obj_id, None)
+                    for index in indexes:
+                        index.discard(obj_id)
+                JOURNAL_SIZES[s_class] = JOURNAL_SIZES.get(s_class, 0) + 1
+        return True
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
+        The snapshot replaces the file at once, then the journal it
+        now includes is deleted. Nothing is saved with a STORAGE
+        backend: it stores each change itself.
         """
+        if STORAGE is not None:
+            return
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        with cls._file_lock():
+            # a copy: the Flusher thread saves while requests change DATA
+            cls.write_snapshot(dict(DATA[s_class]))
+            journal_path = ".db_{}.journal".format(s_class)
+            if path.exists(journal_path):
+                os.remove(journal_path)
+            JOURNAL_SIZES[s_class] = 0
+            cls._update_stamp()
+
+    @classmethod
+    def get_snapshot_format(cls) -> str:
+        """ Return the format of the snapshot of the class
+        """
+        return getenv('BASE_SNAPSHOT_FORMAT_' + cls.__name__.upper(),
+                      cls.snapshot_format)
+
+    @classmethod
+    def snapshot_path(cls, fmt: str = None) -> str:
+        """ Return the path of the snapshot file in a format, by default
+        the format of the class
+        """
+        fmt = fmt or cls.get_snapshot_format()
+        if fmt not in SNAPSHOT_FORMATS:
+            raise ValueError("unknown snapshot format: {}".format(fmt))
+        return ".db_{}.{}".format(cls.__name__, fmt)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f, indent=4)
+    @classmethod
+    def read_snapshot(cls, fmt: str = None) -> dict:
+        """ Read a snapshot file, {} if there is none
+        Return the objects by id; with LAZY_LOAD, a JSON snapshot gives
+        their JSON dict instead
+        """
+        fmt = fmt or cls.get_snapshot_format()
+        file_path = cls.snapshot_path(fmt)
+        if not path.exists(file_path):
+            return {}
+        if fmt == 'json':
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+            if LAZY_LOAD:
+                return objs_json
+            return {obj_id: cls(**obj_json)
+                    for obj_id, obj_json in objs_json.items()}
+        with open(file_path, 'rb') as f:
+            if fmt == 'marshal':
+                table = marshal.load(f)
+            else:
+                table = msgpack.unpack(f, raw=False)
+        columns = table["columns"]
+        objs = {}
+        for row in table["rows"]:
+            # built from the slots directly: no parsing, no __init__
+            obj = cls.__new__(cls)
+            for name, value in zip(columns, row):
+                object.__setattr__(obj, name, value)
+            objs[obj.id] = obj
+        return objs
+
+    @classmethod
+    def write_snapshot(cls, objs: dict, fmt: str = None):
+        """ Write objects (or their JSON dict) by id to a snapshot file
+        The file is replaced at once.
+        """
+        fmt = fmt or cls.get_snapshot_format()
+        file_path = cls.snapshot_path(fmt)
+        # one temporary file per writer, so that none replaces another's
+        tmp_path = "{}.{}-{}.tmp".format(file_path, os.getpid(),
+                                         threading.get_ident())
+        if fmt == 'json':
+            objs_json = {}
+            for obj_id, obj in objs.items():
+                # an object never loaded is still in its serialized form
+                objs_json[obj_id] = obj if type(obj) is dict \
+                    else obj.to_json(True)
+            with open(tmp_path, 'w') as f:
+                json.dump(objs_json, f, indent=4)
+        else:
+            columns = ('id', '_created_at', '_updated_at') + cls._fields
+            rows = []
+            for obj in objs.values():
+                if type(obj) is dict:
+                    obj = cls(**obj)
+                rows.append([getattr(obj, c, None) for c in columns])
+            table = {"columns": list(columns), "rows": rows}
+            with open(tmp_path, 'wb') as f:
+                if fmt == 'marshal':
+                    marshal.dump(table, f)
+                else:
+                    msgpack.pack(table, f)
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def convert_snapshot(cls, source: str, target: str):
+        """ Rewrite the snapshot of the class from a format to another
+        """
+        with cls._file_lock():
+            cls.write_snapshot(cls.read_snapshot(source), target)
+
+    @classmethod
+    def append_to_journal(cls, changes: List[dict]):
+        """ Append changes to the journal, compacting it when full
+        A change is {"op": "put", "id": ..., "obj": ...} or
+        {"op": "del", "id": ...}
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        with cls._file_lock():
+            with open(journal_path, 'a') as f:
+                f.write("".join(json.dumps(c) + "\n" for c in changes))
+            JOURNAL_SIZES[s_class] = JOURNAL_SIZES.get(s_class, 0) + \
+                len(changes)
+            if JOURNAL_SIZES[s_class] >= JOURNAL_COMPACT_SIZE:
+                cls.save_to_file()
+            cls._update_stamp()
+
+    @classmethod
+    def _write_changes(cls, changes: List[tuple]):
+        """ Write (op, obj) changes with the PERSISTENCE mode
+        """
+        if PERSISTENCE != 'journal':
+            cls.save_to_file()
+            return
+        records = []
+        for op, obj in changes:
+            if op == "put":
+                records.append({"op": op, "id": obj.id,
+                                "obj": obj.to_json(True)})
+            else:
+                records.append({"op": op, "id": obj.id})
+        cls.append_to_journal(records)
+
+    @classmethod
+    def _persist(cls, changes: List[tuple]):
+        """ Write (op, obj) changes ("put" or "del" of obj) at once, or
+        queue them for the Flusher in write-behind mode
+        """
+        if WRITE_BEHIND_MS > 0 and not MULTIPROCESS:
+            flusher = _get_flusher()
+            for op, obj in changes:
+                flusher.add(cls, op, obj)
+        else:
+            cls._write_changes(changes)
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        if STORAGE is not None:
+            STORAGE.save(self)
+            return
+        # the latest state of the other workers is read before writing
+        with self.__class__._file_lock():
+            self.__class__._refresh()
+            DATA[s_class][self.id] = self
+            for index in self.__class__._indexes():
+                index.add(self.id, self)
+            self.__class__._persist([("put", self)])
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        if STORAGE is not None:
+            STORAGE.remove(self)
+            return
+        with self.__class__._file_lock():
+            self.__class__._refresh()
+            if DATA[s_class].get(self.id) is not None:
+                del DATA[s_class][self.id]
+                for index in self.__class__._indexes():
+                    index.discard(self.id)
+                self.__class__._persist([("del", self)])
+
+    @classmethod
+    def save_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save objects of the class as one batch
+        They are all stamped with the same updated_at, and written to
+        the file (or the STORAGE backend) once for the whole batch.
+        """
+        objs = list(objs)
+        if len(objs) == 0:
+            return
+        now = datetime.utcnow()
+        for obj in objs:
+            obj.updated_at = now
+        if STORAGE is not None:
+            STORAGE.save_many(cls, objs)
+            return
+        s_class = cls.__name__
+        with cls._file_lock():
+            cls._refresh()
+            indexes = cls._indexes()
+            for obj in objs:
+                DATA[s_class][obj.id] = obj
+                for index in indexes:
+                    index.add(obj.id, obj)
+            cls._persist([("put", obj) for obj in objs])
+
+    @classmethod
+    def remove_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Remove objects of the class as one batch
+        The objects not found are ignored; the others are written to
+        the file (or the STORAGE backend) once for the whole batch.
+        """
+        objs = list(objs)
+        if len(objs) == 0:
+            return
+        if STORAGE is not None:
+            STORAGE.remove_many(cls, objs)
+            return
+        s_class = cls.__name__
+        with cls._file_lock():
+            cls._refresh()
+            indexes = cls._indexes()
+            removed = []
+            for obj in objs:
+                if DATA[s_class].pop(obj.id, None) is None:
+                    continue
+                for index in indexes:
+                    index.discard(obj.id)
+                removed.append(("del", obj))
+            if removed:
+                cls._persist(removed)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
+        if STORAGE is not None:
+            return STORAGE.count(cls)
+        cls._refresh()
         s_class = cls.__name__
         return len(DATA[s_class].keys())
 
@@ -119,13 +913,45 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
+        if STORAGE is not None:
+            return STORAGE.get(cls, id)
+        cls._refresh()
+        return cls._hydrate(id)
+
+    @classmethod
+    def get_many(cls, ids: Iterable[str]) -> List[TypeVar('Base')]:
+        """ Return the objects of several IDs, in the same order, None
+        for an ID not found
+        """
+        ids = list(ids)
+        if STORAGE is not None:
+            return STORAGE.get_many(cls, ids)
+        cls._refresh()
+        return [cls._hydrate(id) for id in ids]
+
+    @classmethod
+    def _hydrate(cls, id: str) -> TypeVar('Base'):
+        """ Return one object by ID, building it if it is not loaded
+        """
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        obj = DATA[s_class].get(id)
+        if type(obj) is dict:
+            obj = cls(**obj)
+            DATA[s_class][id] = obj
+        return obj
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+        An indexed attribute of the query narrows the search to the
+        objects indexed with its value, instead of scanning them all.
         """
+        if STORAGE is not None:
+            # the backend compares the values in their to_json form
+            return STORAGE.search(cls, {
+                k: v.strftime(TIMESTAMP_FORMAT) if type(v) is datetime
+                else v for k, v in attributes.items()})
+        cls._refresh()
         s_class = cls.__name__
 
         def _search(obj):
@@ -136,4 +962,88 @@ class Base():
                     return False
             return True
 
-        return list(filter(_search, DATA[s_class].values()))
+        ids = DATA[s_class].keys()
+        for k, v in attributes.items():
+            index = INDEXES[s_class].get(k)
+            if index is not None and index.usable:
+                ids = index.lookup(v)
+                break
+        return list(filter(_search, [cls._hydrate(obj_id)
+                                     for obj_id in list(ids)]))
+
+    @classmethod
+    def _sorted_index(cls, attribute: str):
+        """ Return the usable SortedIndex of one of the
+        sorted_attributes, building it on first use, or None
+        """
+        if attribute not in cls.sorted_attributes:
+            return None
+        indexes = SORTED_INDEXES[cls.__name__]
+        index = indexes.get(attribute)
+        if index is None:
+            # not built by load_from_file: it would parse every
+            # timestamp of a lazy load
+            index = SortedIndex(attribute, attribute in TIMESTAMP_ATTRIBUTES)
+            index.build(DATA[cls.__name__].items())
+            indexes[attribute] = index
+        return index if index.usable else None
+
+    @classmethod
+    def _scan_sorted(cls, attribute: str, match) -> List[TypeVar('Base')]:
+        """ Return the objects whose value of attribute is not None and
+        matches, sorted by that value, scanning them all
+        """
+        found = []
+        try:
+            for obj_id in list(DATA[cls.__name__].keys()):
+                obj = cls._hydrate(obj_id)
+                value = getattr(obj, attribute, None)
+                if value is not None and match(value):
+                    found.append((value, obj_id, obj))
+            found.sort(key=lambda item: item[:2])
+        except TypeError:
+            # values that can't be compared match nothing
+            return []
+        return [obj for _, _, obj in found]
+
+    @classmethod
+    def search_range(cls, attribute: str, low=None,
+                     high=None) -> List[TypeVar('Base')]:
+        """ Search the objects with low <= attribute < high, sorted by
+        the attribute; None is no bound, and objects valued None never
+        match. A SortedIndex of the attribute (see sorted_attributes)
+        avoids scanning all objects.
+        """
+        if STORAGE is not None:
+            return STORAGE.search_range(cls, attribute, *(
+                v.strftime(TIMESTAMP_FORMAT) if type(v) is datetime else v
+                for v in (low, high)))
+        cls._refresh()
+        index = cls._sorted_index(attribute)
+        if index is None:
+            return cls._scan_sorted(attribute, lambda value: (
+                (low is None or low <= value) and
+                (high is None or value < high)))
+        if index.timestamp:
+            try:
+                low, high = (None if v is None else timestamp(v)
+                             for v in (low, high))
+            except (TypeError, ValueError):
+                return []
+        return [cls._hydrate(obj_id) for obj_id in index.range(low, high)]
+
+    @classmethod
+    def search_prefix(cls, attribute: str,
+                      prefix: str) -> List[TypeVar('Base')]:
+        """ Search the objects with a string attribute starting with
+        prefix, sorted by the attribute. A SortedIndex of the attribute
+        (see sorted_attributes) avoids scanning all objects.
+        """
+        if STORAGE is not None:
+            return STORAGE.search_prefix(cls, attribute, prefix)
+        cls._refresh()
+        index = cls._sorted_index(attribute)
+        if index is None:
+            return cls._scan_sorted(attribute, lambda value: (
+                type(value) is str and value.startswith(prefix)))
+        return [cls._hydrate(obj_id) for obj_id in index.prefix(prefix)]
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+""" Storage module
+"""
+from abc import ABC, abstractmethod
+from typing import TypeVar, List
+import sqlite3
+import threading
+
+
+class Storage(ABC):
+    """ Storage backend of the models
+    Base.get, search, count, all, save and remove are delegated to the
+    backend chosen by BASE_STORAGE. An object is stored as its
+    to_json(True) dictionary, and built back with cls(**dictionary).
+    A backend must implement every abstract method to be created; the
+    batch methods default to loops over the single-object ones.
+    """
+
+    @abstractmethod
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Return one object by ID, None if not found
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Return the objects with matching attributes, the values
+        being given in their to_json form
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def search_range(self, cls: type, attribute: str, low,
+                     high) -> List[TypeVar('Base')]:
+        """ Return the objects with low <= attribute < high, sorted by
+        the attribute, the bounds being given in their to_json form;
+        None is no bound
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def search_prefix(self, cls: type, attribute: str,
+                      prefix: str) -> List[TypeVar('Base')]:
+        """ Return the objects with a string attribute starting with
+        prefix, sorted by the attribute
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self, cls: type) -> int:
+        """ Count all objects of a class
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update an object
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete an object
+        """
+        raise NotImplementedError
+
+    def get_many(self, cls: type, ids: List[str]) -> List[TypeVar('Base')]:
+        """ Return the objects of several IDs, in the same order, None
+        for an ID not found
+        """
+        return [self.get(cls, id) for id in ids]
+
+    def save_many(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Insert or update objects of a class
+        """
+        for obj in objs:
+            self.save(obj)
+
+    def remove_many(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Delete objects of a class
+        """
+        for obj in objs:
+            self.remove(obj)
+
+
+class SQLiteStorage(Storage):
+    """ Storage of the models in a SQLite database
+    Each model has its table, with one column per to_json(True) key and
+    a SQLite index on each of its indexed_attributes and
+    sorted_attributes. The timestamps are stored in their to_json form,
+    which sorts in time order.
+    """
+
+    # the most ? parameters of one statement in older SQLite versions
+    MAX_VARIABLES = 999
+
+    def __init__(self, file_path: str):
+        """ Initialize a SQLiteStorage on a database file
+        """
+        self.file_path = file_path
+        # sqlite3 connections can't be shared between threads
+        self._local = threading.local()
+        self._tables = set()
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Return the connection of the current thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # autocommit: each statement is its own transaction
+            conn = sqlite3.connect(self.file_path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _columns(cls: type) -> tuple:
+        """ Return the columns of the table of a model
+        """
+        return ('id', 'created_at', 'updated_at') + cls._fields
+
+    def _column(self, cls: type, name: str) -> str:
+        """ Return the column storing an attribute of a model: its own,
+        or the slot of a property (password is stored as _password)
+        Raise AttributeError for any other name: SQLite would take a
+        quoted unknown name for a string and match nothing.
+        """
+        columns = self._columns(cls)
+        if name in columns:
+            return name
+        if isinstance(getattr(cls, name, None), property) and \
+                '_' + name in columns:
+            return '_' + name
+        raise AttributeError("{} has no stored attribute {}".format(
+            cls.__name__, name))
+
+    def _table(self, cls: type) -> str:
+        """ Return the table of a model, creating it on first use
+        """
+        table = cls.__name__
+        if table in self._tables:
+            return table
+        conn = self._connection()
+        columns = ", ".join('"{}"'.format(c) for c in self._columns(cls))
+        conn.execute('CREATE TABLE IF NOT EXISTS "{}" ({}, '
+                     'PRIMARY KEY ("id"))'.format(table, columns))
+        for attr in cls.indexed_attributes + cls.sorted_attributes:
+            conn.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" '
+                         'ON "{0}" ("{1}")'.format(table, attr))
+        self._tables.add(table)
+        return table
+
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Return one object by ID, None if not found
+        """
+        row = self._connection().execute(
+            'SELECT * FROM "{}" WHERE "id" = ?'.format(self._table(cls)),
+            (id,)).fetchone()
+        return cls(**dict(row)) if row is not None else None
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Return the objects with matching attributes, in insertion
+        order
+        """
+        columns = [self._column(cls, k) for k in attributes]
+        query = 'SELECT * FROM "{}"'.format(self._table(cls))
+        if attributes:
+            # IS compares like = but also matches None to NULL
+            query += " WHERE " + " AND ".join(
+                '"{}" IS ?'.format(c) for c in columns)
+        rows = self._connection().execute(query + " ORDER BY rowid",
+                                          tuple(attributes.values()))
+        return [cls(**dict(row)) for row in rows]
+
+    def _search_sorted(self, cls: type, attribute: str, conditions: list,
+                       params: list) -> List[TypeVar('Base')]:
+        """ Return the objects of a model matching conditions on one
+        attribute, sorted by it
+        """
+        attribute = self._column(cls, attribute)
+        query = 'SELECT * FROM "{}" WHERE "{}" IS NOT NULL'.format(
+            self._table(cls), attribute)
+        for condition in conditions:
+            query += ' AND "{}" {}'.format(attribute, condition)
+        rows = self._connection().execute(
+            query + ' ORDER BY "{}", "id"'.format(attribute), params)
+        return [cls(**dict(row)) for row in rows]
+
+    def search_range(self, cls: type, attribute: str, low,
+                     high) -> List[TypeVar('Base')]:
+        """ Return the objects with low <= attribute < high, sorted by
+        the attribute; None is no bound
+        """
+        conditions, params = [], []
+        if low is not None:
+            conditions.append(">= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append("< ?")
+            params.append(high)
+        return self._search_sorted(cls, attribute, conditions, params)
+
+    def search_prefix(self, cls: type, attribute: str,
+                      prefix: str) -> List[TypeVar('Base')]:
+        """ Return the objects with a string attribute starting with
+        prefix, sorted by the attribute
+        """
+        if prefix == "":
+            return self._search_sorted(cls, attribute, ["GLOB '*'"], [])
+        # a range on the index: prefix <= value < the next prefix
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return self._search_sorted(cls, attribute, [">= ?", "< ?"],
+                                   [prefix, upper])
+
+    def count(self, cls: type) -> int:
+        """ Count all objects of a class
+        """
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM "{}"'.format(self._table(cls))).fetchone()[0]
+
+    def _upsert(self, cls: type) -> str:
+        """ Return the statement inserting or updating an object of a
+        model, keeping its row in place
+        """
+        columns = self._columns(cls)
+        return 'INSERT INTO "{}" ({}) VALUES ({}) ' \
+            'ON CONFLICT ("id") DO UPDATE SET {}'.format(
+                self._table(cls),
+                ", ".join('"{}"'.format(c) for c in columns),
+                ", ".join("?" * len(columns)),
+                ", ".join('"{0}" = excluded."{0}"'.format(c)
+                          for c in columns if c != 'id'))
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update an object, keeping its row in place
+        """
+        cls = obj.__class__
+        data = obj.to_json(True)
+        self._connection().execute(
+            self._upsert(cls),
+            tuple(data.get(c) for c in self._columns(cls)))
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete an object
+        """
+        self._connection().execute(
+            'DELETE FROM "{}" WHERE "id" = ?'.format(
+                self._table(obj.__class__)), (obj.id,))
+
+    def _executemany(self, query: str, params: List[tuple]):
+        """ Run a statement for each parameters in one transaction
+        """
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(query, params)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get_many(self, cls: type, ids: List[str]) -> List[TypeVar('Base')]:
+        """ Return the objects of several IDs, in the same order, None
+        for an ID not found
+        """
+        table = self._table(cls)
+        conn = self._connection()
+        found = {}
+        for i in range(0, len(ids), self.MAX_VARIABLES):
+            chunk = ids[i:i + self.MAX_VARIABLES]
+            rows = conn.execute(
+                'SELECT * FROM "{}" WHERE "id" IN ({})'.format(
+                    table, ", ".join("?" * len(chunk))), chunk)
+            for row in rows:
+                found[row["id"]] = cls(**dict(row))
+        return [found.get(id) for id in ids]
+
+    def save_many(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Insert or update objects of a class in one transaction
+        """
+        columns = self._columns(cls)
+        params = []
+        for obj in objs:
+            data = obj.to_json(True)
+            params.append(tuple(data.get(c) for c in columns))
+        self._executemany(self._upsert(cls), params)
+
+    def remove_many(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Delete objects of a class in one transaction
+        """
+        self._executemany(
+            'DELETE FROM "{}" WHERE "id" = ?'.format(self._table(cls)),
+            [(obj.id,) for obj in objs])
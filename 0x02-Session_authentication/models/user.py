@@ -2,12 +2,16 @@
 """ User module
 """
 import hashlib
-from models.base import Base
+from models.base import Base, intern
 
 
 class User(Base):
     """ User class
     """
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    indexed_attributes = ('email',)
+    # admin lookups by email prefix
+    sorted_attributes = ('email',)
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
@@ -15,8 +19,8 @@ class User(Base):
         super().__init__(*args, **kwargs)
         self.email = kwargs.get('email')
         self._password = kwargs.get('_password')
-        self.first_name = kwargs.get('first_name')
-        self.last_name = kwargs.get('last_name')
+        self.first_name = intern(kwargs.get('first_name'))
+        self.last_name = intern(kwargs.get('last_name'))
 
     @property
     def password(self) -> str:
@@ -1,16 +1,21 @@
 #!/usr/bin/env python3
 """ User module
 """
-from models.base import Base
+from models.base import Base, intern
 
 
 class UserSession(Base):
     """ UserSession class
     """
+    __slots__ = ('user_id', 'session_id')
+    indexed_attributes = ('session_id', 'user_id')
+    # expiry sweeps: the sessions created before a time
+    sorted_attributes = ('created_at',)
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a UserSession instance
         """
         super().__init__(*args, **kwargs)
-        self.user_id = kwargs.get('user_id')
+        # a user has many sessions: their user_id is one string
+        self.user_id = intern(kwargs.get('user_id'))
         self.session_id = kwargs.get('session_id')